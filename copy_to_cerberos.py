@@ -26,7 +26,8 @@ from utils import (
     proc_patterns,
     file_contains,
     askForConfig,
-    project_paths
+    project_paths,
+    scan_dir
 )
 
 global local_dir
@@ -325,9 +326,10 @@ def make_process_list(paths, check_existing=False):
     jobs = []
     
     if sinuhe:
-        natmeg_subjects  = [s for s in glob(f'NatMEG_*', root_dir=sinuhe) if isdir(f'{sinuhe}/{s}')]
+        sinuhe_entries = scan_dir(sinuhe)
+        natmeg_subjects  = [name for name, is_dir in sinuhe_entries if is_dir and name.startswith('NatMEG_')]
         subjects = sorted(list(set([s.split('_')[-1] for s in natmeg_subjects])))
-        other_files_and_dirs = [f for f in glob(f'*', root_dir=sinuhe) if f not in natmeg_subjects]
+        other_files_and_dirs = [name for name, _ in sinuhe_entries if name not in natmeg_subjects]
 
         for item in other_files_and_dirs:
             source = f'{sinuhe}/{item}'
@@ -337,14 +339,15 @@ def make_process_list(paths, check_existing=False):
             # copy_file(source, destination, logfile=logfile, log_path=log_path)
         
         for subject in subjects:
-            sessions = sorted([session for session in glob('*', root_dir = f'{sinuhe}/NatMEG_{subject}')
-            if isdir(f'{sinuhe}/NatMEG_{subject}/{session}') and re.match(r'^\d{6}$', session)
-            ])
             sinuhe_subject_dir = f'{sinuhe}/NatMEG_{subject}'
+            subject_entries = scan_dir(sinuhe_subject_dir)
+            sessions = sorted([session for session, is_dir in subject_entries
+            if is_dir and re.match(r'^\d{6}$', session)
+            ])
             local_subject_docs_dir = f'{docspath}/sub-{subject}'
             local_subject_dir = f'{local_dir}/sub-{subject}'
             
-            items = [f for f in glob(f'*', root_dir=sinuhe_subject_dir) if f not in sessions]
+            items = [f for f, _ in subject_entries if f not in sessions]
             for item in items:
                 source = f'{sinuhe_subject_dir}/{item}'
                 destination = f'{local_subject_docs_dir}_{item}'
@@ -353,7 +356,7 @@ def make_process_list(paths, check_existing=False):
                 # copy_file(source, destination, logfile=logfile, log_path=log_path)
                 
             for session in sessions:
-                items = [f for f in glob(f'*', root_dir=f'{sinuhe_subject_dir}/{session}/meg')]
+                items = [f for f, _ in scan_dir(f'{sinuhe_subject_dir}/{session}/meg')]
                 for item in items:
                     source = f'{sinuhe_subject_dir}/{session}/meg/{item}'
                     destination = f'{local_dir}/sub-{subject}/{session}/triux/{item}'
@@ -369,9 +372,10 @@ def make_process_list(paths, check_existing=False):
 
     
     if kaptah:
-        kaptah_subjects  = [s for s in glob(f'sub-*', root_dir=kaptah) if isdir(f'{kaptah}/{s}')]
+        kaptah_entries = scan_dir(kaptah)
+        kaptah_subjects  = [name for name, is_dir in kaptah_entries if is_dir and name.startswith('sub-')]
         
-        other_files_and_dirs = [f for f in glob(f'*', root_dir=kaptah) if f not in kaptah_subjects]
+        other_files_and_dirs = [name for name, _ in kaptah_entries if name not in kaptah_subjects]
         
         subjects = sorted(list(set([s.split('-')[-1] for s in kaptah_subjects])))
         
@@ -382,7 +386,8 @@ def make_process_list(paths, check_existing=False):
 
         for subject in subjects:
 
-            all_files = glob(f'*', root_dir=f'{kaptah}/sub-{subject}')
+            # List the subject directory once and reuse it for all sessions
+            all_files = [f for f, _ in scan_dir(f'{kaptah}/sub-{subject}')]
             # Extract unique dates from session folder names (assuming date format in session name, e.g., '20240607')
             hedscan_dates = set()
             for session in all_files:
@@ -394,7 +399,7 @@ def make_process_list(paths, check_existing=False):
             local_subject_dir = f'{local_dir}/sub-{subject}'
             
             # Copy any files not marked with a date
-            items = [f for f in glob(f'*', root_dir=kaptah_subject_dir) 
+            items = [f for f in all_files
                      if not any(f.startswith(f'20{session}') for session in sessions)]
             for item in items:
                 source = f'{kaptah_subject_dir}/{item}'
@@ -403,7 +408,7 @@ def make_process_list(paths, check_existing=False):
 
             for session in sessions:
                 
-                items = sorted([f for f in glob(f'*', root_dir=kaptah_subject_dir)
+                items = sorted([f for f in all_files
                                 if f.startswith(f'20{session}')])
 
                 # Create a mapping of original to renamed files to handle files with task name at different times
@@ -564,6 +569,13 @@ def copy_files(paths):
 
     return results
 
+def _stat_or_none(path):
+    """Return os.stat(path), or None if the path cannot be stat'ed."""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
 def update_copy_report(results, paths):
     """
     Update the copy results report with new entries, avoiding duplicates.
@@ -614,6 +626,9 @@ def update_copy_report(results, paths):
                 'destinations': dest_files
             }
     
+    # One timestamp per report update keeps entries from the same run consistent
+    now_iso = datetime.now().isoformat()
+    
     new_entries = []
     for source_file, group_info in source_groups.items():
         # Filter out destinations that already exist in the report
@@ -629,44 +644,45 @@ def update_copy_report(results, paths):
         
         # Only create an entry if there are new destinations
         if new_destinations:
-            # Get file sizes
-            original_size = None
-            if exists(source_file):
-                try:
-                    original_size = getsize(source_file)
-                except (OSError, FileNotFoundError):
-                    original_size = None
+            # Stat the source once for both size and ctime
+            source_stat = _stat_or_none(source_file)
+            original_size = source_stat.st_size if source_stat else None
+            copy_dt = datetime.fromtimestamp(source_stat.st_ctime) if source_stat else None
             
-            # Calculate destination file sizes
-            dest_size = None
-            try:
-                if isinstance(new_destinations, list):
-                    dest_size = sum([getsize(dest) for dest in new_destinations if exists(dest)])
-                else:
-                    dest_size = getsize(new_destinations) if exists(new_destinations) else None
-            except (OSError, FileNotFoundError):
-                dest_size = None
-
-            # Prepare size values (single value or list matching destination structure)
+            # Calculate destination file sizes (one stat per destination)
+            if isinstance(new_destinations, list):
+                dest_stats = [_stat_or_none(dest) for dest in new_destinations]
+                dest_size = sum(st.st_size for st in dest_stats if st)
+            else:
+                dest_stat = _stat_or_none(new_destinations)
+                dest_size = dest_stat.st_size if dest_stat else None
 
             new_entries.append({
                 'Original File': source_file,
-                'Copy Date': datetime.fromtimestamp(os.path.getctime(source_file)).strftime('%y%m%d'),
-                'Copy Time': datetime.fromtimestamp(os.path.getctime(source_file)).strftime('%H%M%S'),
+                'Copy Date': copy_dt.strftime('%y%m%d') if copy_dt else None,
+                'Copy Time': copy_dt.strftime('%H%M%S') if copy_dt else None,
                 'New file(s)': new_destinations,
                 'Original Size': original_size,
                 'Total Destination Size': dest_size,
                 'Transfer Status': 'Success' if group_info['success'] else 'Failed',
                 'status': group_info['message'],  # Standardized field name for filtering
-                'timestamp': datetime.now().isoformat()
+                'timestamp': now_iso
             })
     
     # Combine existing and new entries
     updated_report = existing_report + new_entries
     
-    # Write updated report back to file
-    with open(report_file, 'w') as f:
-        json.dump(updated_report, f, indent=4)
+    # Write updated report to a temporary file and swap it in atomically so an
+    # interrupted run never leaves a truncated report behind
+    # Serialize once and issue a single write + fsync rather than the many
+    # small writes json.dump makes while pretty-printing
+    tmp_report_file = f'{report_file}.tmp'
+    report_data = json.dumps(updated_report, indent=4)
+    with open(tmp_report_file, 'w') as f:
+        f.write(report_data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_report_file, report_file)
     
     # Log summary of this session
     log('Copy', f'Report updated: {len(new_entries)} new entries added to existing {len(existing_report)} entries',
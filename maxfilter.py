@@ -15,33 +15,21 @@ Based on an original MaxFilter shell script by Mikkel Vinding and Lau Møller An
 
 """
 #%%
-from glob import glob
 import os
-from os.path import exists, basename, dirname, isdir
+from os.path import exists, basename, dirname
 import sys
 import re
 import json
 import yaml
 from typing import Union
-import pandas as pd
 import subprocess
+import shlex
 import argparse
 from datetime import datetime
 
 from shutil import copy2
-from copy import deepcopy
-import mne
-from mne.transforms import (invert_transform,
-                            read_trans, write_trans)
-from mne.preprocessing import compute_average_dev_head_t
-from mne.chpi import (compute_chpi_amplitudes, compute_chpi_locs,
-                      head_pos_to_trans_rot_t, compute_head_pos,
-                      write_head_pos,
-                      read_head_pos)
-# Set matplotlib backend to non-GUI to avoid Qt issues
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.patches as mpatches
+# mne and matplotlib are imported inside the functions that need them, so
+# running MaxFilter on sessions without head position tasks does not load them
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from utils import (
@@ -49,7 +37,8 @@ from utils import (
     proc_patterns,
     noise_patterns,
     file_contains,
-    askForConfig
+    askForConfig,
+    scan_dir
 )
 
 ###############################################################################
@@ -58,6 +47,17 @@ from utils import (
 
 exclude_patterns = [r'-\d+.fif', '_trans', 'opm',  'eeg', 'avg.fif']
 
+# Use the libyaml C parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# Single alternation of everything that disqualifies a file from processing
+_EXCLUDE_RE = re.compile('|'.join(exclude_patterns + proc_patterns), re.IGNORECASE)
+# Task names treated as empty room recordings
+_NOISE_RE = re.compile('|'.join(noise_patterns))
+
 
 ###############################################################################
 # Configuration and Parameter Functions
@@ -90,13 +90,16 @@ def get_parameters(config):
                 config_dict = json.load(f)
         elif config.endswith('.yml') or config.endswith('.yaml'):
             with open(config, 'r') as f:
-                config_dict = yaml.safe_load(f)
+                config_dict = yaml.load(f, Loader=_YamlLoader)
         else:
             raise ValueError("Unsupported configuration file format. Use .json or .yml/.yaml")
     elif isinstance(config, dict):
-        config_dict = deepcopy(config)
+        config_dict = config
     
-    maxfilter_dict = deepcopy(config_dict['MaxFilter'])
+    # Only the settings sections below are written to, so a copy of each
+    # section is enough to leave the caller's configuration untouched
+    maxfilter_dict = {key: dict(value) if isinstance(value, dict) else value
+                      for key, value in config_dict['MaxFilter'].items()}
     maxfilter_dict['advanced_settings']['cal'] = config_dict['Project']['Calibration']
     maxfilter_dict['advanced_settings']['ctc'] = config_dict['Project']['Crosstalk']
     maxfilter_dict['standard_settings']['project_name'] = config_dict['Project']['Name']
@@ -123,7 +126,7 @@ def match_task_files(files, task: str):
     Note:
         Excludes files matching exclude_patterns and proc_patterns from utils
     """
-    matched_files = [f for f in files if not file_contains(basename(f).lower(), exclude_patterns + proc_patterns) and task in f]
+    matched_files = [f for f in files if task in f and not _EXCLUDE_RE.search(basename(f))]
     return matched_files
 
 def plot_movement(raw, head_pos, mean_trans):
@@ -135,7 +138,8 @@ def plot_movement(raw, head_pos, mean_trans):
     and transformation quality.
     
     Args:
-        raw (mne.io.Raw): Raw MEG data with device-head transformation
+        raw (mne.io.Raw or mne.Info): Raw MEG data, or just its measurement
+            info, with device-head transformation
         head_pos (str or array): Head position file path or position array
         mean_trans (str or dict): Mean transformation file path or transform
     
@@ -147,13 +151,21 @@ def plot_movement(raw, head_pos, mean_trans):
         - Shows original position (red) vs average (green)
         - Includes legend and tight layout
     """
+    # Set matplotlib backend to non-GUI to avoid Qt issues
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.patches as mpatches
+    import mne
+    from mne.chpi import read_head_pos
+    from mne.transforms import invert_transform, read_trans
 
     if isinstance(head_pos, str):
         head_pos = read_head_pos(head_pos)
     if isinstance(mean_trans, str):
         mean_trans = read_trans(mean_trans)
         
-    original_head_dev_t = invert_transform(raw.info["dev_head_t"])
+    info = raw if isinstance(raw, mne.Info) else raw.info
+    original_head_dev_t = invert_transform(info["dev_head_t"])
     
     """
     Plot trances of movement for insepction. Uses mne.viz.plot_head_positions
@@ -245,6 +257,7 @@ class MaxFilter:
                 parameters[key] = False
 
         self.parameters = parameters
+        self._common_params = None
     
     def create_task_headpos(self, 
                             data_path: str,
@@ -252,6 +265,7 @@ class MaxFilter:
                             task: str,
                             files,  # list or str
                             overwrite=False,
+                            existing=None,
                             **kwargs):
         """
         Generate average head position and transformation for task runs.
@@ -274,6 +288,8 @@ class MaxFilter:
             task (str): Task name for file naming
             files (list or str): Raw file(s) for head position calculation
             overwrite (bool): Whether to regenerate existing files
+            existing (set, optional): Names already in out_path, used instead
+                of checking each output file on disk
             **kwargs: Additional parameters passed to computation functions
         
         Returns:
@@ -290,6 +306,12 @@ class MaxFilter:
             - Merges runs if merge_runs parameter enabled
             - Uses compute_chpi_* functions from MNE for localization
         """
+        import mne
+        from mne.transforms import invert_transform, write_trans
+        from mne.preprocessing import compute_average_dev_head_t
+        from mne.chpi import (compute_chpi_amplitudes, compute_chpi_locs,
+                              compute_head_pos, write_head_pos,
+                              read_head_pos)
 
         parameters = self.parameters
 
@@ -299,77 +321,86 @@ class MaxFilter:
         trans_file = f"{out_path}/{task}_trans.fif"
         fig_name = f"{out_path}/{task}_movement.png"
 
-        if not exists(headpos_name) or overwrite:
-            
-            if isinstance(files, str):
-                files = [files]
-            raws = [mne.io.read_raw_fif(
-                    f'{data_path}/{file}',
-                    allow_maxshield=True,
-                    verbose='error')
-                        for file in files]
+        if isinstance(files, str):
+            files = [files]
+
+        def is_done(path):
+            if existing is not None:
+                return basename(path) in existing
+            return exists(path)
+
+        # Raw data is loaded at most once and shared by the headpos, trans and plot steps
+        raw = None
+        # Results computed in this call are passed on in memory instead of re-read
+        head_pos = None
+        mean_trans = None
+
+        def load_raw():
+            nonlocal raw
+            if raw is None:
+                if merge_headpos and len(files) > 1:
+                    raws = [mne.io.read_raw_fif(
+                            f'{data_path}/{file}',
+                            allow_maxshield=True,
+                            verbose='error')
+                                for file in files]
+                    raws[0].info['dev_head_t'] = raws[1].info['dev_head_t']
+                    raw = mne.concatenate_raws(raws)
+                else:
+                    # Only the first run is used when runs are not merged
+                    raw = mne.io.read_raw_fif(
+                        f'{data_path}/{files[0]}',
+                        allow_maxshield=True,
+                        verbose='error')
+            return raw
+
+        if not is_done(headpos_name) or overwrite:
             
-            if merge_headpos and len(files) > 1:
-                raws[0].info['dev_head_t'] = raws[1].info['dev_head_t']
-                raw = mne.concatenate_raws(raws)
-            else:
-                raw = raws[0]
+            raw = load_raw()
             print(f"Creating average head position for files: {' | '.join(files)}")
             chpi_amplitudes = compute_chpi_amplitudes(raw)
             chpi_locs = compute_chpi_locs(raw.info, chpi_amplitudes)
             head_pos = compute_head_pos(raw.info, chpi_locs, verbose='error')
             
-            write_head_pos(headpos_name, head_pos)
+            # Write to a hidden temporary file and swap it in, so an interrupted
+            # run never leaves a partial file that would be skipped next time
+            tmp_headpos = f"{out_path}/.{task}_headpos.pos.tmp"
+            write_head_pos(tmp_headpos, head_pos)
+            os.replace(tmp_headpos, headpos_name)
             print(f"Wrote headposition file to: {basename(headpos_name)}")
         else:
             print(f'{basename(headpos_name)} already exists. Skipping...')
         
-        if not exists(trans_file) or overwrite:
-
-            if isinstance(files, str):
-                files = [files]
-            raws = [mne.io.read_raw_fif(
-                    f'{data_path}/{file}',
-                    allow_maxshield=True,
-                    verbose='error')
-                        for file in files]
-            
-            if merge_headpos and len(files) > 1:
-                raws[0].info['dev_head_t'] = raws[1].info['dev_head_t']
-                raw = mne.concatenate_raws(raws)
-            else:
-                raw = raws[0]
+        if not is_done(trans_file) or overwrite:
 
-            head_pos = read_head_pos(headpos_name)
+            raw = load_raw()
+            if head_pos is None:
+                head_pos = read_head_pos(headpos_name)
             # trans, rot, t = head_pos_to_trans_rot_t(head_pos) 
 
             mean_trans = invert_transform(
                 compute_average_dev_head_t(raw, head_pos))
             
-            write_trans(trans_file, mean_trans, overwrite=True)
+            # MNE expects trans files to end in _trans.fif
+            tmp_trans = f"{out_path}/.{task}.tmp_trans.fif"
+            write_trans(tmp_trans, mean_trans, overwrite=True)
+            os.replace(tmp_trans, trans_file)
             print(f'Wrote trans file to {basename(trans_file)}')
         
         else:
             print(f'{basename(trans_file)} already exists. Skipping...')
         
-        if not exists(fig_name) or overwrite:
-            # Need to load raw data for plotting if not already loaded
-            if 'raw' not in locals():
-                if isinstance(files, str):
-                    files = [files]
-                raws = [mne.io.read_raw_fif(
-                        f'{data_path}/{file}',
-                        allow_maxshield=True,
-                        verbose='error')
-                            for file in files]
-                
-                if merge_headpos and len(files) > 1:
-                    raws[0].info['dev_head_t'] = raws[1].info['dev_head_t']
-                    raw = mne.concatenate_raws(raws)
-                else:
-                    raw = raws[0]
-            
-            plot_movement(raw, headpos_name, trans_file).savefig(fig_name)
+        if not is_done(fig_name) or overwrite:
+            if raw is not None:
+                info = raw.info
+            else:
+                # The plot only needs the device-to-head transform, so skip the
+                # data; merged runs take it from the second run
+                info_file = files[1] if merge_headpos and len(files) > 1 else files[0]
+                info = mne.io.read_info(f'{data_path}/{info_file}', verbose='error')
+            plot_movement(info,
+                          headpos_name if head_pos is None else head_pos,
+                          trans_file if mean_trans is None else mean_trans).savefig(fig_name)
 
     def set_params(self, subject, session, task):
         """
@@ -418,6 +449,8 @@ class MaxFilter:
         trans_file = f'{subj_path}/{task}_trans.fif'
         trans_conditions = parameters.get('trans_conditions')
         trans_option = parameters.get('trans_option')
+        movecomp_default = parameters.get('movecomp_default')
+        correlation = parameters.get('correlation')
 
         def set_trans(param=None):
             if 'continous' in trans_option and task in trans_conditions:
@@ -434,40 +467,153 @@ class MaxFilter:
             return(set_parameter(mxf, mne_mxf, string))
         _trans = set_trans(trans_file)
         
-        # create set_force function
-        def set_force(param=None):
-            if param:
-                mxf = '-force'
-            elif not param:
-                mxf = ''
-            else:
-                print('faulty "force" setting')
-                sys.exit(1)
-            return(mxf)
-        _force = set_force(parameters.get('force'))
+        # Options that only depend on the configuration are resolved once per run;
+        # movecomp and trans vary with the task and are set below
+        common = self._common_params
+        if common is None:
+            downsample_factor = parameters.get('downsample_factor')
+            linefreq_hz = parameters.get('linefreq_Hz')
+            badlimit = parameters.get('badlimit')
+
+            # create set_force function
+            def set_force(param=None):
+                if param:
+                    mxf = '-force'
+                elif not param:
+                    mxf = ''
+                else:
+                    print('faulty "force" setting')
+                    sys.exit(1)
+                return(mxf)
+            _force = set_force(parameters.get('force'))
         
-        def set_cal(param=None):
-            if param:
-                mxf = '-cal %s' % param
-                mne_mxf = '--calibration=%s' % param
-                string = 'cal_'
-            else:
-                print('no "cal" file found')
-                sys.exit(1)
-            return(set_parameter(mxf, mne_mxf, string))
-        _cal = set_cal(parameters.get('cal'))
+            def set_cal(param=None):
+                if param:
+                    mxf = '-cal %s' % param
+                    mne_mxf = '--calibration=%s' % param
+                    string = 'cal_'
+                else:
+                    print('no "cal" file found')
+                    sys.exit(1)
+                return(set_parameter(mxf, mne_mxf, string))
+            _cal = set_cal(parameters.get('cal'))
         
-        def set_ctc(param=None):
-            if param:
-                mxf = '-ctc %s' % param
-                mne_mxf = '--cross_talk=%s' % param
-                string = 'ctc_'
-            else:
-                print('no "ctc" file found')
-                sys.exit(1)
-            return(set_parameter(mxf, mne_mxf, string))
-        _ctc = set_ctc(parameters.get('ctc'))
+            def set_ctc(param=None):
+                if param:
+                    mxf = '-ctc %s' % param
+                    mne_mxf = '--cross_talk=%s' % param
+                    string = 'ctc_'
+                else:
+                    print('no "ctc" file found')
+                    sys.exit(1)
+                return(set_parameter(mxf, mne_mxf, string))
+            _ctc = set_ctc(parameters.get('ctc'))
         
+            # create set_tsss function
+            def set_tsss(param=None):
+                if param:
+                    mxf = '-st'
+                    mne_mxf='--st'
+                    string='tsss'
+                elif not param:
+                    mxf = ''
+                    mne_mxf=''
+                    string=''
+                else:
+                    print('faulty "tsss" setting')
+                    sys.exit(1)
+                return(set_parameter(mxf,mne_mxf, string))
+            _tsss = set_tsss(parameters.get('tsss_default'))
+        
+            # create set_ds function
+            def set_ds(param=None):
+                if param:
+                    if int(downsample_factor) > 1:
+                        mxf = '-ds %s' % downsample_factor
+                        mne_mxf = ''
+                        string = 'dsfactor-%s_' % downsample_factor
+                    else:
+                        print('downsampling factor must be an INTEGER greater than 1')
+                elif not param:
+                    mxf = ''
+                    mne_mxf = ''
+                    string=''
+                else:
+                    print('faulty "downsampling" setting')
+                    sys.exit(1)
+                return(set_parameter(mxf, mne_mxf, string))
+            _ds = set_ds(parameters.get('downsample'))
+
+            def set_corr(param=None):
+                if param:
+                    mxf = '-corr %s' % param
+                    mne_mxf = '--corr=%s' % param
+                    string = 'corr %s_' % \
+                        round(float(param)*100)
+                elif not param:
+                    mxf = ''
+                    mne_mxf= ''
+                    string=''
+                else:
+                    print('faulty "correlation" setting (must be between 0 and 1)')
+                    sys.exit(1)
+                return(set_parameter(mxf, mne_mxf, string))
+            _corr = set_corr(correlation)
+
+            # set linefreq according to wishes above and abort if set incorrectly
+            def set_linefreq(param=None):
+                if param:
+                    mxf = '-linefreq %s' % linefreq_hz
+                    mne_mxf = '--linefreq %s' % linefreq_hz
+                    string = 'linefreq-%s_' % linefreq_hz
+                elif not param:
+                    mxf = ''
+                    mne_mxf = ''
+                    string = ''
+                else:
+                    print('faulty "apply_linefreq" setting')
+                    sys.exit(1)
+                return(set_parameter(mxf, mne_mxf, string))
+            _linefreq = set_linefreq(parameters.get('apply_linefreq'))
+
+            # Set autobad parameters
+            def set_autobad(param=None):
+                if param:
+                    mxf = '-autobad %s -badlimit %s' % (param, badlimit)
+                    mne_mxf = '--autobad=%s' % badlimit
+                    string = 'autobad_%s' % param
+                elif not param:
+                    mxf = '-autobad %s' % param
+                    mxf = '--autobad %s' % param
+                    string = ''
+                else:
+                    print('faulty "autobad" setting')
+                    sys.exit(1)
+                return(set_parameter(mxf, mne_mxf, string))
+            _autobad = set_autobad(parameters.get('autobad'))
+
+            def set_bad_channels(param=None):
+                if param:
+                    if isinstance(param, list):
+                        bad_ch = ' '.join(param)
+                    else:
+                        bad_ch = param
+                    mxf = '-bad %s' % bad_ch
+                    mne_mxf = '--bad %s' % bad_ch
+                    string = '_bad_%s' % bad_ch
+                elif not param:
+                    mxf = ''
+                    mne_mxf= ''
+                    string=''
+                else:
+                    print('faulty "bad_channels" setting (must be comma separated list)')
+                    sys.exit(1)
+                return(set_parameter(mxf, mne_mxf, string))
+            _bad_channels = set_bad_channels(parameters.get('bad_channels'))
+            common = self._common_params = (
+                _force, _cal, _ctc, _tsss, _ds, _corr, _linefreq, _autobad, _bad_channels)
+        _force, _cal, _ctc, _tsss, _ds, _corr, _linefreq, _autobad, _bad_channels = common
+
         # create set_mc function (sets movecomp according to wishes above and abort if set incorrectly, this is a function such that it can be changed throughout the script if empty_room files are found) 
         def set_mc(param=None):
             if param:
@@ -482,116 +628,13 @@ class MaxFilter:
                 print('faulty "movecomp" setting')
                 sys.exit(1)
             return(set_parameter(mxf, mne_mxf, string))
-        _mc = set_mc(parameters.get('movecomp_default'))
+        _mc = set_mc(movecomp_default)
         # If empty room file set tsss off and remove trans and headpos
-        if file_contains(task, noise_patterns):
+        if _NOISE_RE.search(task):
             _mc.mxf = ''
             _mc.mne_mxf = ''
             _mc.string = ''
 
-        # create set_tsss function
-        def set_tsss(param=None):
-            if param:
-                mxf = '-st'
-                mne_mxf='--st'
-                string='tsss'
-            elif not param:
-                mxf = ''
-                mne_mxf=''
-                string=''
-            else:
-                print('faulty "tsss" setting')
-                sys.exit(1)
-            return(set_parameter(mxf,mne_mxf, string))
-        _tsss = set_tsss(parameters.get('tsss_default'))
-        
-        # create set_ds function
-        def set_ds(param=None):
-            if param:
-                if int(parameters.get('downsample_factor')) > 1:
-                    mxf = '-ds %s' % parameters.get('downsample_factor')
-                    mne_mxf = ''
-                    string = 'dsfactor-%s_' % \
-                        parameters.get('downsample_factor')
-                else:
-                    print('downsampling factor must be an INTEGER greater than 1')
-            elif not param:
-                mxf = ''
-                mne_mxf = ''
-                string=''
-            else:
-                print('faulty "downsampling" setting')
-                sys.exit(1)
-            return(set_parameter(mxf, mne_mxf, string))
-        _ds = set_ds(parameters.get('downsample'))
-
-        def set_corr(param=None):
-            if param:
-                mxf = '-corr %s' % param
-                mne_mxf = '--corr=%s' % param
-                string = 'corr %s_' % \
-                    round(float(param)*100)
-            elif not param:
-                mxf = ''
-                mne_mxf= ''
-                string=''
-            else:
-                print('faulty "correlation" setting (must be between 0 and 1)')
-                sys.exit(1)
-            return(set_parameter(mxf, mne_mxf, string))
-        _corr = set_corr(parameters.get('correlation'))
-
-        # set linefreq according to wishes above and abort if set incorrectly
-        def set_linefreq(param=None):
-            if param:
-                mxf = '-linefreq %s' % parameters.get('linefreq_Hz')
-                mne_mxf = '--linefreq %s' % parameters.get('linefreq_Hz')
-                string = 'linefreq-%s_' % parameters.get('linefreq_Hz')
-            elif not param:
-                mxf = ''
-                mne_mxf = ''
-                string = ''
-            else:
-                print('faulty "apply_linefreq" setting')
-                sys.exit(1)
-            return(set_parameter(mxf, mne_mxf, string))
-        _linefreq = set_linefreq(parameters.get('apply_linefreq'))
-
-        # Set autobad parameters
-        def set_autobad(param=None):
-            if param:
-                mxf = '-autobad %s -badlimit %s' % (param, parameters.get('badlimit'))
-                mne_mxf = '--autobad=%s' % parameters.get('badlimit')
-                string = 'autobad_%s' % param
-            elif not param:
-                mxf = '-autobad %s' % param
-                mxf = '--autobad %s' % param
-                string = ''
-            else:
-                print('faulty "autobad" setting')
-                sys.exit(1)
-            return(set_parameter(mxf, mne_mxf, string))
-        _autobad = set_autobad(parameters.get('autobad'))
-
-        def set_bad_channels(param=None):
-            if param:
-                if isinstance(param, list):
-                    bad_ch = ' '.join(param)
-                else:
-                    bad_ch = param
-                mxf = '-bad %s' % bad_ch
-                mne_mxf = '--bad %s' % bad_ch
-                string = '_bad_%s' % bad_ch
-            elif not param:
-                mxf = ''
-                mne_mxf= ''
-                string=''
-            else:
-                print('faulty "bad_channels" setting (must be comma separated list)')
-                sys.exit(1)
-            return(set_parameter(mxf, mne_mxf, string))
-        _bad_channels = set_bad_channels(parameters.get('bad_channels'))
-
         tsss_default = parameters.get('tsss_default')
         
         if task in parameters.get('sss_files'):
@@ -601,16 +644,15 @@ class MaxFilter:
             proc = []
             if tsss_default:
                 proc.append(_tsss.string)
-                if parameters.get('correlation'):
-                    corr_value = parameters.get('correlation')
-                    proc.append(f'corr{round(float(corr_value)*100)}')
+                if correlation:
+                    proc.append(f'corr{round(float(correlation)*100)}')
             else:
                 proc.append('sss')
 
-            if parameters.get('movecomp_default'):
+            if movecomp_default:
                 proc.append(_mc.string)
             
-            if 'continous' in trans_option and task in parameters.get('trans_conditions'):
+            if 'continous' in trans_option and task in trans_conditions:
                 proc.append(_trans.string)
             
             proc = [p for p in proc if p != '']
@@ -636,7 +678,148 @@ class MaxFilter:
         self._merge_runs = _merge_runs
         self._additional_cmd = _additional_cmd
 
-    def process_task_files(self, subject, session, task, files, subj_in, subj_out, maxfilter_path, naming_conv):
+    def task_command_args(self, subject, session, task):
+        """
+        Resolve the MaxFilter options for a task into plain values.
+        
+        Runs set_params and snapshots the result, so the returned values can
+        be handed to worker threads without depending on the instance
+        attributes that the next set_params call overwrites.
+        
+        Args:
+            subject (str): Subject identifier
+            session (str): Session identifier
+            task (str): Task name
+        
+        Returns:
+            tuple: (processing string, list of MaxFilter command-line options)
+        """
+        self.set_params(subject, session, task)
+        mxf_args = [
+            self._cal.mxf,
+            self._ctc.mxf,
+            self._trans.mxf,
+            self._tsss.mxf,
+            self._ds.mxf,
+            self._corr.mxf,
+            self._mc.mxf,
+            self._autobad.mxf,
+            self._bad_channels.mxf,
+            self._linefreq.mxf,
+            self._force,
+            self._additional_cmd
+        ]
+        return self._proc, mxf_args
+
+    def process_file(self, subject, session, task, file, subj_in, subj_out, maxfilter_path, naming_conv, _proc, mxf_args, existing=None):
+        """
+        Run MaxFilter on a single file.
+        
+        Args:
+            subject (str): Subject identifier
+            session (str): Session identifier
+            task (str): Task name
+            file (str): File to process
+            subj_in (str): Input directory path
+            subj_out (str): Output directory path
+            maxfilter_path (str): Path to MaxFilter executable
+            naming_conv (regex): Naming convention pattern
+            _proc (str): Processing string from task_command_args
+            mxf_args (list): MaxFilter options from task_command_args
+            existing (set, optional): Names already in subj_out, used instead
+                of checking the output file on disk
+        
+        Returns:
+            tuple: (success, input file, output file)
+        """
+        debug = self.parameters.get('debug', False)
+
+        # Files are listed by their .fif extension, so swap the suffix by slicing
+        clean = f'{file[:-4]}_proc-{_proc}.fif'
+        ncov = naming_conv.search(clean)
+        
+        if not ncov:
+            clean = f'{clean[:-4]}_meg.fif'
+
+        # Use absolute path
+        file_path = f"{subj_in}/{file}"
+        clean_path = f"{subj_out}/{clean}"
+        log_file = f'{subj_out}/log/{clean[:-4]}.log'
+        
+        print(f'Input file: {file_path}')
+        print(f'Expected output: {clean_path}')
+
+        # Unused options are empty strings; leave them out of the command
+        mxf_opts = ' '.join(arg for arg in mxf_args if arg)
+        command_mxf = f'{maxfilter_path} -f {file_path} -o {clean_path} {mxf_opts} -v'
+
+        if (clean in existing) if existing is not None else exists(clean_path):
+            print(f'''
+                Existing file: {clean_path}
+                Delete to rerun MaxFilter process
+                ''')
+            return (True, file, clean)  # Already exists
+
+        #TODO: add check for bads and exclude?
+        # raw = mne.io.read_raw_fif(file_path, allow_maxshield=True, verbose='error')
+        # bads = mne.preprocessing.find_bad_channels_maxwell(
+        #     raw=raw,
+        #     calibration=self._cal.mxf.replace('-cal ', ''),
+        #     cross_talk=self._ctc.mxf.replace('-ctc ', ''),
+        #     verbose='error'
+        # )
+
+        print(f'Running MaxFilter on {subject} | {session} | {task} | {file}')
+        if debug:
+            print(command_mxf)
+            return (True, file, clean)  # Dry run success
+
+        try:
+            # Paths are passed as separate arguments so they are never
+            # re-tokenized; only option strings such as '-cal <file>' are split
+            command_argv = [
+                maxfilter_path,
+                '-f', file_path,
+                '-o', clean_path,
+                *shlex.split(mxf_opts),
+                '-v'
+                ]
+            # Run MaxFilter directly instead of through a shell and tee; its
+            # output is echoed to the terminal and appended to the file log
+            # Output is read as bytes so undecodable characters (e.g. Latin-1
+            # project paths) cannot break the loop and kill MaxFilter mid-run;
+            # the log gets the raw bytes, as tee wrote them
+            stdout_encoding = sys.stdout.encoding or 'utf-8'
+            with open(log_file, 'ab') as log_fh, subprocess.Popen(
+                command_argv,
+                cwd=subj_in,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=os.environ.copy()  # Use copy of environment
+            ) as result:
+                for line in result.stdout:
+                    sys.stdout.write(line.decode(stdout_encoding, errors='backslashreplace'))
+                    log_fh.write(line)
+            print(f"MaxFilter exit code: {result.returncode}")
+            
+            # Check if the output file was actually created (more reliable than exit code)
+            if os.path.exists(clean_path):
+                log('MaxFilter', f'{file_path} -> {clean_path}', 'info', logfile=self.logfile, logpath=self.logpath)
+                print(f'Successfully processed: {os.path.basename(clean)}')
+                if existing is not None:
+                    existing.add(clean)
+                return (True, file, clean)
+            else:
+                print(f'MaxFilter failed - output file not created at: {clean_path}')
+                print(f'Exit code: {result.returncode}')
+                log('MaxFilter', f'Failed to create {clean_path}. Exit code: {result.returncode}', 'error', logfile=self.logfile, logpath=self.logpath)
+                return (False, file, clean)
+        except Exception as e:
+            print(f'Error occurred while running MaxFilter: {e}. See {self.logfile} for details.')
+            log('MaxFilter', f'Exception during processing: {e}', 'error', logfile=self.logfile, logpath=self.logpath)
+            return (False, file, clean)
+
+    def process_task_files(self, subject, session, task, files, subj_in, subj_out, maxfilter_path, naming_conv, max_workers=1):
         """
         Process all files for a specific task, potentially in parallel.
         
@@ -649,106 +832,41 @@ class MaxFilter:
             subj_out (str): Output directory path
             maxfilter_path (str): Path to MaxFilter executable
             naming_conv (regex): Naming convention pattern
+            max_workers (int): Number of MaxFilter processes to run at once
         
         Returns:
             list: List of processing results
         """
-        parameters = self.parameters
-        debug = parameters.get('debug', False)
-        
-        # Set parameters for this task
-        self.set_params(subject, session, task)
-        _proc = self._proc
+        _proc, mxf_args = self.task_command_args(subject, session, task)
+        jobs = [(subject, session, task, file, subj_in, subj_out, maxfilter_path, naming_conv, _proc, mxf_args)
+                for file in files]
+        return self.run_file_jobs(jobs, max_workers=max_workers)
+
+    def run_file_jobs(self, jobs, max_workers=1):
+        """
+        Run process_file for a list of jobs, up to max_workers at a time.
         
-        results = []
+        Args:
+            jobs (list): Argument tuples for process_file
+            max_workers (int): Number of MaxFilter processes to run at once
         
-        for file in files:
-            clean = file.replace('.fif', f'_proc-{_proc}.fif')
-            ncov = naming_conv.search(clean)
-            
-            if not ncov:
-                clean = clean.replace('.fif', '_meg.fif')
+        Returns:
+            list: Processing results of the jobs that completed
+        """
+        if max_workers == 1 or len(jobs) <= 1:
+            # Sequential processing
+            return [self.process_file(*job) for job in jobs]
 
-            # Use absolute path
-            file_path = f"{subj_in}/{file}"
-            clean_path = f"{subj_out}/{clean}"
-            log_file = f'{subj_out}/log/{os.path.basename(clean).replace(".fif",".log")}'
+        # Parallel file processing
+        results = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+            futures = [executor.submit(self.process_file, *job) for job in jobs]
             
-            print(f'Input file: {file_path}')
-            print(f'Expected output: {clean_path}')
-
-            command_list = []
-            command_list.extend([
-                maxfilter_path,
-                '-f %s' % file_path,
-                '-o %s' % clean_path,
-                self._cal.mxf,
-                self._ctc.mxf,
-                self._trans.mxf,
-                self._tsss.mxf,
-                self._ds.mxf,
-                self._corr.mxf,
-                self._mc.mxf,
-                self._autobad.mxf,
-                self._bad_channels.mxf,
-                self._linefreq.mxf,
-                self._force,
-                self._additional_cmd,
-                '-v',
-                '| tee -a %s' % log_file
-                ])
-            command_mxf = ' '.join(command_list)
-            command_mxf = re.sub(r'\\s+', ' ', command_mxf).strip()
-
-            if not exists(clean_path):
-
-                #TODO: add check for bads and exclude?
-                # raw = mne.io.read_raw_fif(file_path, allow_maxshield=True, verbose='error')
-                # bads = mne.preprocessing.find_bad_channels_maxwell(
-                #     raw=raw,
-                #     calibration=self._cal.mxf.replace('-cal ', ''),
-                #     cross_talk=self._ctc.mxf.replace('-ctc ', ''),
-                #     verbose='error'
-                # )
-
-                print(f'Running MaxFilter on {subject} | {session} | {task} | {file}')
-                if not debug:
-                    try:
-                        # Use safer subprocess options for threading
-                        result = subprocess.run(
-                            command_mxf, 
-                            shell=True, 
-                            cwd=subj_in,
-                            capture_output=False,  # Don't capture to avoid buffer issues
-                            text=True,
-                            env=os.environ.copy()  # Use copy of environment
-                        )
-                        print(f"MaxFilter exit code: {result.returncode}")
-                        
-                        # Check if the output file was actually created (more reliable than exit code)
-                        if os.path.exists(clean_path):
-                            log('MaxFilter', f'{file_path} -> {clean_path}', 'info', logfile=self.logfile, logpath=self.logpath)
-                            print(f'Successfully processed: {os.path.basename(clean)}')
-                            results.append((True, file, clean))
-                        else:
-                            print(f'MaxFilter failed - output file not created at: {clean_path}')
-                            print(f'Exit code: {result.returncode}')
-                            log('MaxFilter', f'Failed to create {clean_path}. Exit code: {result.returncode}', 'error', logfile=self.logfile, logpath=self.logpath)
-                            results.append((False, file, clean))
-                    except Exception as e:
-                        print(f'Error occurred while running MaxFilter: {e}. See {self.logfile} for details.')
-                        log('MaxFilter', f'Exception during processing: {e}', 'error', logfile=self.logfile, logpath=self.logpath)
-                        results.append((False, file, clean))
-                else:
-                    print(command_mxf)
-                    results.append((True, file, clean))  # Dry run success
-            else:
-                print(f'''
-                    Existing file: {clean_path}
-                    Delete to rerun MaxFilter process
-                    ''')
-                results.append((True, file, clean))  # Already exists
-        
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Error in file processing: {e}")
         return results
 
     def run_command(self, subject, session, max_workers=1):
@@ -773,7 +891,7 @@ class MaxFilter:
         Args:
             subject (str): Subject directory name
             session (str): Session directory name
-            max_workers (int): Number of parallel workers for task processing
+            max_workers (int): Number of parallel workers for head position and MaxFilter jobs
         
         Returns:
             None
@@ -811,11 +929,14 @@ class MaxFilter:
         
         # Create maxfilter log directory if it doesn't exist
         os.makedirs(f'{subj_out}/log', exist_ok=True)
+
+        # One directory read instead of a stat per expected output file
+        existing = set(os.listdir(subj_out))
         
         maxfilter_path = parameters.get('maxfilter_version')
 
         # List all files in directory
-        all_fifs = sorted(glob('*.fif', root_dir=subj_in))
+        all_fifs = sorted(name for name, is_dir in scan_dir(subj_in) if not is_dir and name.endswith('.fif'))
 
         # Create patterns to exclude files
         
@@ -844,47 +965,53 @@ class MaxFilter:
         # Remove if empty
         tasks_to_run = [t for t in tasks_to_run if t != '']
 
-        # Prepare task processing - create head position files first (sequential)
+        # Prepare task processing - head position files must exist before MaxFilter runs
+        # Apply the exclusion patterns once per session rather than once per task
+        candidates = match_task_files(all_fifs, '')
+        
         task_data = []
+        headpos_jobs = []
         for task in tasks_to_run:
-            files = match_task_files(all_fifs, task)
+            files = [f for f in candidates if task in f]
             
             if not files:
                 print(f'No files found for task: {task}')
                 continue
 
-            # Average head position (must be done sequentially due to file I/O)
             if task in trans_files:
-                self.create_task_headpos(subj_in, subj_out, task, files, overwrite=False)
+                headpos_jobs.append((task, files))
             
             task_data.append((task, files))
 
-        # Process tasks - potentially in parallel
-        if max_workers == 1 or len(task_data) == 1:
-            # Sequential processing
-            for task, files in task_data:
-                self.process_task_files(subject, session, task, files, subj_in, subj_out, maxfilter_path, naming_conv)
+        # Average head position - cHPI fitting is CPU-bound, so use processes
+        if max_workers == 1 or len(headpos_jobs) <= 1:
+            for task, files in headpos_jobs:
+                self.create_task_headpos(subj_in, subj_out, task, files, overwrite=False, existing=existing)
         else:
-            # Parallel task processing
-            with ThreadPoolExecutor(max_workers=min(max_workers, len(task_data))) as executor:
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(headpos_jobs))) as executor:
                 futures = [
-                    executor.submit(self.process_task_files, subject, session, task, files, subj_in, subj_out, maxfilter_path, naming_conv) 
-                    for task, files in task_data
+                    executor.submit(self.create_task_headpos, subj_in, subj_out, task, files, overwrite=False, existing=existing)
+                    for task, files in headpos_jobs
                 ]
-                
                 for future in as_completed(futures):
-                    try:
-                        results = future.result()
-                        # Process results if needed
-                    except Exception as e:
-                        print(f"Error in task processing: {e}")
+                    future.result()
+
+        # Resolve each task's options up front (set_params mutates the instance),
+        # then run MaxFilter per file so single-file tasks also run in parallel
+        jobs = []
+        for task, files in task_data:
+            _proc, mxf_args = self.task_command_args(subject, session, task)
+            for file in files:
+                jobs.append((subject, session, task, file, subj_in, subj_out, maxfilter_path, naming_conv, _proc, mxf_args, existing))
+
+        self.run_file_jobs(jobs, max_workers=max_workers)
 
     def loop_dirs(self, max_workers=4):
         """
-        Process multiple subjects and sessions sequentially with task-level parallelization.
+        Process multiple subjects and sessions sequentially with file-level parallelization.
         
-        Orchestrates MaxFilter processing across entire dataset with efficient parallel
-        execution at the task level within each subject/session. Handles subject filtering, 
+        Orchestrates MaxFilter processing across entire dataset, running head position
+        and MaxFilter jobs in parallel within each subject/session. Handles subject filtering, 
         session discovery, and error management for large-scale processing.
         
         Processing Workflow:
@@ -892,24 +1019,25 @@ class MaxFilter:
         2. Filter subjects based on skip list
         3. Discover sessions within each subject directory
         4. Process each (subject, session) sequentially
-        5. Within each subject/session, parallelize task processing
+        5. Within each subject/session, run head position jobs in a process pool
+           and MaxFilter on each file in parallel
         6. Handle exceptions and continue processing on failures
         
         Args:
-            max_workers (int): Maximum number of parallel workers for task processing (default: 4)
+            max_workers (int): Number of parallel workers for head position and MaxFilter jobs (default: 4)
         
         Returns:
             None
             
         Side Effects:
-            - Processes subjects/sessions sequentially but tasks in parallel
+            - Processes subjects/sessions sequentially but files in parallel
             - Creates all output files and logs
             - Prints progress and error messages
             - Continues processing despite individual failures
         
         Performance Notes:
             - Sequential subject/session processing prevents resource conflicts
-            - Parallel task processing within each subject improves efficiency
+            - Parallel per-file processing within each subject improves efficiency
             - Safer for subprocess management and file I/O
             - Reduced memory usage compared to full parallelization
         
@@ -921,7 +1049,7 @@ class MaxFilter:
         parameters = self.parameters
         data_root = parameters.get('data_path')
         
-        subjects = sorted([s for s in glob('*', root_dir=data_root) if os.path.isdir(f'{data_root}/{s}') and (s.startswith('sub') or s.startswith('NatMEG'))])
+        subjects = sorted(s for s, is_dir in scan_dir(data_root) if is_dir and (s.startswith('sub') or s.startswith('NatMEG')))
         skip_subjects = parameters.get('subjects_to_skip')
 
         if not isinstance(skip_subjects, list):
@@ -934,11 +1062,11 @@ class MaxFilter:
 
         # Process each subject/session sequentially
         for subject in subjects:
-            sessions = sorted([s for s in sorted(glob('*', root_dir=f'{data_root}/{subject}')) if isdir(f'{data_root}/{subject}/{s}')])
+            sessions = sorted(s for s, is_dir in scan_dir(f'{data_root}/{subject}') if is_dir)
             for session in sessions:
                 print(f'Running MaxFilter on {subject} | {session} |')
                 try:
-                    # Pass max_workers to enable task-level parallelization
+                    # max_workers caps concurrent head position and MaxFilter jobs
                     self.run_command(subject, session, max_workers=max_workers)
                 except Exception as e:
                     print(f"Error processing {subject}/{session}: {e}")
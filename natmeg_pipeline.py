@@ -6,13 +6,9 @@ Main executable entry point for the NatMEG processing pipeline
 import sys
 import os
 import argparse
-from pathlib import Path
 import yaml
 from utils import log, configure_logging
 
-# Add the current directory to the Python path
-sys.path.insert(0, str(Path(__file__).parent))
-
 def main():
     """Main entry point for the natmeg command"""
     parser = argparse.ArgumentParser(
@@ -1,9 +1,7 @@
 import argparse
-import pandas as pd
 from glob import glob
 import os
 from os.path import join, isdir, dirname, basename
-from mne_bids import print_dir_tree
 import re
 from jinja2 import Environment, FileSystemLoader, TemplateNotFound
 from typing import Union
@@ -91,6 +89,7 @@ def create_hierarchical_list(tree, current_path="", level=0):
     """Convert nested directory tree to hierarchical list maintaining folder structure.
     Classic tree order: folders first (at current level), then files.
     Files in a directory are shown at the same indentation level as their sibling folders.
+    Every item carries a 'key' (folder path or file relpath) used for lookups.
     """
     items = []
 
@@ -104,6 +103,7 @@ def create_hierarchical_list(tree, current_path="", level=0):
             'name': dir_name,
             'type': 'folder',
             'path': dir_path,
+            'key': dir_path,
             'folder_path': current_path,
             'level': level,
             'mtime': dir_mtime,
@@ -119,6 +119,7 @@ def create_hierarchical_list(tree, current_path="", level=0):
                 'name': file_info['name'],
                 'type': 'file',
                 'relpath': file_info['relpath'],
+                'key': file_info['relpath'],
                 'folder_path': current_path,
                 'level': level,
                 'mtime': file_info['mtime'],
@@ -154,17 +155,6 @@ def get_directory_size(dir_tree):
             total += get_directory_size(value)
     return total
 
-def _flatten_files(tree, base_path=""):
-    files = {}
-    for key, val in tree.items():
-        if key == '__files__':
-            for f in val:
-                files[os.path.join(base_path, f['relpath'] if 'relpath' in f else f['name'])] = f
-        elif isinstance(val, dict):
-            sub_base = os.path.join(base_path, key) if base_path else key
-            files.update(_flatten_files(val, sub_base))
-    return files
-
 def dict_to_table_report(data, title="File Report", output_file="table_report.html", remote_tree=None):
     """Generate a SINGLE hierarchical comparison tree with side-by-side Local / Remote columns."""
     from datetime import datetime
@@ -196,54 +186,36 @@ def dict_to_table_report(data, title="File Report", output_file="table_report.ht
     if remote_tree is None:
         remote_tree = {}
 
-    local_flat = _flatten_files(data)
-    remote_flat = _flatten_files(remote_tree)
-
-    # Create simple flat structure without tree complexity
-    all_paths = set(local_flat.keys()) | set(remote_flat.keys())
-    
-    # Get all directory paths
-    all_dirs = set()
-    for path in all_paths:
-        parts = path.split(os.sep)
-        for i in range(1, len(parts)):
-            dir_path = os.sep.join(parts[:i])
-            all_dirs.add(dir_path)
-    
     # Use the existing hierarchical list creation from local and remote trees
     local_hierarchy = create_hierarchical_list(data)
     remote_hierarchy = create_hierarchical_list(remote_tree)
     
-    # Create dictionaries for quick lookup
-    local_items = {item.get('path') or item.get('relpath'): item for item in local_hierarchy}
-    remote_items = {item.get('path') or item.get('relpath'): item for item in remote_hierarchy}
+    # Single pass per hierarchy: build the lookup dicts, the local path order
+    # and the list of remote-only items at the same time
+    local_items = {}
+    complete_paths = []
+    for item in local_hierarchy:
+        path = item['key']
+        local_items[path] = item
+        complete_paths.append(path)
+    
+    remote_items = {}
+    remote_only_items = []
+    for item in remote_hierarchy:
+        path = item['key']
+        remote_items[path] = item
+        if path not in local_items:
+            remote_only_items.append(item)
     
     # Build a complete hierarchical list that includes remote-only files in proper tree positions
     def build_complete_hierarchy():
-        """Build a complete hierarchy that properly integrates remote-only files."""
-        # Start with local hierarchy as base
-        complete_paths = []
-        path_set = set()
-        
-        # Add all local paths first (maintaining order)
-        for item in local_hierarchy:
-            path = item.get('path') or item.get('relpath')
-            complete_paths.append(path)
-            path_set.add(path)
-        
-        # For remote-only items, insert them in proper hierarchical position
-        remote_only_items = []
-        for item in remote_hierarchy:
-            path = item.get('path') or item.get('relpath')
-            if path not in path_set:
-                remote_only_items.append(item)
-        
+        """Insert remote-only items into the local path order at their tree positions."""
         # Sort remote-only items by their path depth and name to maintain hierarchy
-        remote_only_items.sort(key=lambda x: (x['level'], (x.get('path') or x.get('relpath')).lower()))
+        remote_only_items.sort(key=lambda x: (x['level'], x['key'].lower()))
         
         # Insert remote-only items in correct positions
         for remote_item in remote_only_items:
-            remote_path = remote_item.get('path') or remote_item.get('relpath')
+            remote_path = remote_item['key']
             remote_parent = remote_item.get('folder_path', '')
             remote_level = remote_item['level']
             
@@ -290,65 +262,33 @@ def dict_to_table_report(data, title="File Report", output_file="table_report.ht
     for path in all_paths:
         local_item = local_items.get(path)
         remote_item = remote_items.get(path)
+        item = local_item or remote_item
+        is_dir = item['type'] == 'folder'
         
-        # Determine type from available item
-        item_type = (local_item or remote_item)['type']
-        name = (local_item or remote_item)['name']
-        level = (local_item or remote_item)['level']
-        parent = (local_item or remote_item).get('folder_path', '')
-        
-        if item_type == 'folder':
-            # Directory logic
-            if local_item and remote_item:
-                status = 'ok'
-                if local_item.get('size', 0) != remote_item.get('size', 0):
-                    status = 'issue'
-            elif local_item and not remote_item:
-                status = 'missing_remote'
-            elif remote_item and not local_item:
-                status = 'missing_local'
+        if local_item and remote_item:
+            if local_item.get('size', 0) != remote_item.get('size', 0):
+                status = 'issue' if is_dir else 'size_mismatch'
             else:
                 status = 'ok'
-            
-            rows.append({
-                'type': 'dir',
-                'relpath': path,
-                'name': name,
-                'parent': parent,
-                'level': level,
-                'local_size': local_item.get('size') if local_item else None,
-                'remote_size': remote_item.get('size') if remote_item else None,
-                'local_mtime': local_item.get('mtime') if local_item else None,
-                'remote_mtime': remote_item.get('mtime') if remote_item else None,
-                'local_exists': local_item is not None,
-                'remote_exists': remote_item is not None,
-                'status': status
-            })
+        elif local_item:
+            status = 'missing_remote'
         else:
-            # File logic
-            if local_item and remote_item:
-                status = 'size_mismatch' if local_item.get('size', 0) != remote_item.get('size', 0) else 'ok'
-            elif local_item and not remote_item:
-                status = 'missing_remote'
-            elif remote_item and not local_item:
-                status = 'missing_local'
-            else:
-                status = 'ok'
-            
-            rows.append({
-                'type': 'file',
-                'relpath': path,
-                'name': name,
-                'parent': parent,
-                'level': level,
-                'local_size': local_item.get('size') if local_item else None,
-                'remote_size': remote_item.get('size') if remote_item else None,
-                'local_mtime': local_item.get('mtime') if local_item else None,
-                'remote_mtime': remote_item.get('mtime') if remote_item else None,
-                'local_exists': local_item is not None,
-                'remote_exists': remote_item is not None,
-                'status': status
-            })
+            status = 'missing_local'
+        
+        rows.append({
+            'type': 'dir' if is_dir else 'file',
+            'relpath': path,
+            'name': item['name'],
+            'parent': item.get('folder_path', ''),
+            'level': item['level'],
+            'local_size': local_item.get('size') if local_item else None,
+            'remote_size': remote_item.get('size') if remote_item else None,
+            'local_mtime': local_item.get('mtime') if local_item else None,
+            'remote_mtime': remote_item.get('mtime') if remote_item else None,
+            'local_exists': local_item is not None,
+            'remote_exists': remote_item is not None,
+            'status': status
+        })
 
     # Embedded template
     embedded = """<!DOCTYPE html><html><head><meta charset='utf-8'/><title>{{ title }}</title>
@@ -424,9 +364,10 @@ document.addEventListener('DOMContentLoaded', function(){
 </tbody></table></body></html>"""
 
     template = env.from_string(embedded)
-    html = template.render(title=title, rows=rows)
-    with open(output_file, 'w') as f:
-        f.write(html)
+    # Stream the rendered template to disk instead of building the whole page
+    # in memory; large projects produce one table row per file
+    with open(output_file, 'w', buffering=1 << 20) as f:
+        f.writelines(template.generate(title=title, rows=rows))
     print(f"Report generated: {output_file}")
 
 def count_directories(tree):
@@ -13,6 +13,16 @@ from utils import apply_ansi_colors_to_tk
 
 default_path = '/neuro/data/local'
 
+# Terminal output cleanup: ANSI colour sequences are kept, other non-printable
+# characters are replaced
+_ANSI_SEQ_RE = re.compile(r'(\033\[[0-9;]*m)')
+_NON_PRINTABLE_RE = re.compile(r'[^\x20-\x7E\n\t\r\x00]')
+
+# Progress patterns: "5/30", "45%" and tqdm-style "12it [00:01<00:02"
+_PROGRESS_COUNT_RE = re.compile(r'(\d+)/(\d+)')
+_PROGRESS_PERCENT_RE = re.compile(r'(\d+)%')
+_PROGRESS_TQDM_RE = re.compile(r'(\d+)it \[[\d:]+<[\d:]+')
+
 
 def create_default_config():
     """Create default configuration dictionary without GUI dependencies"""
@@ -807,6 +817,9 @@ class ConfigMainWindow:
     
     def mark_config_changed(self):
         """Mark configuration as changed and update UI accordingly"""
+        # Called on every variable write; the buttons only need updating once
+        if not self.config_saved:
+            return
         self.config_saved = False
         if self.execute_btn:
             self.execute_btn.configure(text="Save to Execute", state='disabled')
@@ -1038,62 +1051,21 @@ class ConfigMainWindow:
     
     def clean_terminal_output(self, text):
         """Clean problematic Unicode characters from terminal output"""
-        # Dictionary of common problematic Unicode characters and their replacements
-        unicode_replacements = {
-            '\u258f': '▏',  # Left one-eighth block
-            '\u258e': '▎',  # Left one-quarter block  
-            '\u258d': '▍',  # Left three-eighths block
-            '\u258c': '▌',  # Left half block
-            '\u258b': '▋',  # Left five-eighths block
-            '\u258a': '▊',  # Left three-quarters block
-            '\u2589': '▉',  # Left seven-eighths block
-            '\u2588': '█',  # Full block
-            '\u2590': '▐',  # Right half block
-            '\u2591': '░',  # Light shade
-            '\u2592': '▒',  # Medium shade
-            '\u2593': '▓',  # Dark shade
-            '\u25cf': '●',  # Black circle
-            '\u25cb': '○',  # White circle
-            '\u25aa': '▪',  # Black small square
-            '\u25ab': '▫',  # White small square
-            '\u2502': '│',  # Box vertical
-            '\u2500': '─',  # Box horizontal
-            '\u250c': '┌',  # Box top-left
-            '\u2510': '┐',  # Box top-right
-            '\u2514': '└',  # Box bottom-left
-            '\u2518': '┘',  # Box bottom-right
-            '\u251c': '├',  # Box vertical-right
-            '\u2524': '┤',  # Box vertical-left
-            '\u252c': '┬',  # Box horizontal-down
-            '\u2534': '┴',  # Box horizontal-up
-            '\u253c': '┼',  # Box cross
-        }
+        # Most lines carry no colour codes; skip the ANSI split for those
+        if '\033' not in text:
+            return _NON_PRINTABLE_RE.sub('?', text)
         
-        # Replace problematic characters
-        for unicode_char, replacement in unicode_replacements.items():
-            text = text.replace(unicode_char, replacement)
+        # Remove non-printable characters EXCEPT newlines, tabs, and ANSI escape sequences.
+        # Splitting on the (captured) ANSI pattern leaves the colour codes at odd
+        # indices, so only the text in between needs cleaning.
+        parts = _ANSI_SEQ_RE.split(text)
+        parts[::2] = [_NON_PRINTABLE_RE.sub('?', part) for part in parts[::2]]
         
-        # Remove non-printable characters EXCEPT newlines, tabs, and ANSI escape sequences
-        import re
-        # Preserve ANSI color codes (\033[...m) by matching and keeping them
-        # Pattern: Match anything that's NOT (printable OR \n OR \t OR \r OR part of ANSI sequence)
-        # First, protect ANSI sequences by temporarily replacing them
-        ansi_pattern = re.compile(r'(\033\[[0-9;]*m)')
-        ansi_codes = ansi_pattern.findall(text)
-        text_with_placeholders = ansi_pattern.sub('\x00ANSI\x00', text)
-        
-        # Now remove other non-printable characters
-        text_cleaned = re.sub(r'[^\x20-\x7E\n\t\r\x00]', '?', text_with_placeholders)
-        
-        # Restore ANSI codes
-        for code in ansi_codes:
-            text_cleaned = text_cleaned.replace('\x00ANSI\x00', code, 1)
-        
-        return text_cleaned
+        return ''.join(parts)
     
     def reset_buttons(self):
         """Reset button states after pipeline execution"""
-        self.execute_btn.configure(state='normal')
+        self.execute_btn.configure(state='normal' if self.config_saved else 'disabled')
         self.abort_btn.configure(state='disabled')
     
     def append_output(self, text):
@@ -1111,11 +1083,9 @@ class ConfigMainWindow:
     
     def update_progress_from_text(self, text):
         """Extract progress information from terminal output and update progress bar"""
-        import re
-        
         # Look for patterns like "Processing file 5/30" or "15/30" or "50%"
         # Pattern 1: "X/Y" format
-        match = re.search(r'(\d+)/(\d+)', text)
+        match = _PROGRESS_COUNT_RE.search(text)
         if match:
             current = int(match.group(1))
             total = int(match.group(2))
@@ -1134,7 +1104,7 @@ class ConfigMainWindow:
                 return
         
         # Pattern 2: Percentage format "45%"
-        match = re.search(r'(\d+)%', text)
+        match = _PROGRESS_PERCENT_RE.search(text)
         if match:
             percentage = int(match.group(1))
             self.progress_bar['value'] = percentage
@@ -1143,7 +1113,7 @@ class ConfigMainWindow:
             return
         
         # Pattern 3: tqdm-style output with elapsed/remaining time
-        match = re.search(r'(\d+)it \[[\d:]+<[\d:]+', text)
+        match = _PROGRESS_TQDM_RE.search(text)
         if match:
             # Indeterminate progress
             if self.progress_bar['mode'] != 'indeterminate':
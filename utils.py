@@ -10,6 +10,7 @@ Author: Andreas Gerhardsson
 from datetime import datetime
 import sys
 import re
+import inspect
 from os.path import basename, join, isdir, exists
 import os
 from glob import glob
@@ -17,6 +18,7 @@ import logging
 from logging import handlers
 from typing import Optional, Dict, Tuple
 from pathlib import Path
+from functools import lru_cache
 import json
 import yaml
 
@@ -169,6 +171,9 @@ ANSI_COLOR_MAP = {
     '0': 'white',       # reset to default (white on black terminal)
 }
 
+# Regex to find ANSI color codes: \033[<code>m
+_ANSI_COLOR_RE = re.compile(r'\033\[(\d+)m')
+
 def apply_ansi_colors_to_tk(text_widget, ansi_text):
     """
     Parse ANSI color codes from text and apply them to a Tkinter Text widget.
@@ -192,10 +197,7 @@ def apply_ansi_colors_to_tk(text_widget, ansi_text):
         Works with the ANSI codes used by _ColoredFormatter in the logging system.
         The text widget should be in 'normal' state for insertion.
     """
-    # Regex to find ANSI color codes: \033[<code>m
-    ansi_regex = re.compile(r'\033\[(\d+)m')
-    
-    matches = list(ansi_regex.finditer(ansi_text))
+    matches = list(_ANSI_COLOR_RE.finditer(ansi_text))
     
     # If no ANSI codes found, just insert the text as-is with white color
     if not matches:
@@ -204,6 +206,21 @@ def apply_ansi_colors_to_tk(text_widget, ansi_text):
     
     pos = 0
     current_color = 'white'
+    # Query the existing tags once and collect (chunk, tag) pairs so the whole
+    # line goes to Tk in a single insert call instead of one per colour chunk
+    known_tags = set(text_widget.tag_names())
+    segments = []
+    
+    def add_segment(chunk, color):
+        # Use color value as tag name for reusability
+        tag_name = f'fg_{color.replace("#", "")}'
+        
+        # Configure tag if not already configured
+        if tag_name not in known_tags:
+            text_widget.tag_config(tag_name, foreground=color)
+            known_tags.add(tag_name)
+        
+        segments.extend((chunk, tag_name))
     
     for match in matches:
         start, end = match.span()
@@ -211,15 +228,7 @@ def apply_ansi_colors_to_tk(text_widget, ansi_text):
         
         # Insert text before this color code with current color
         if start > pos:
-            chunk = ansi_text[pos:start]
-            # Use color value as tag name for reusability
-            tag_name = f'fg_{current_color.replace("#", "")}'
-            
-            # Configure tag if not already configured
-            if tag_name not in text_widget.tag_names():
-                text_widget.tag_config(tag_name, foreground=current_color)
-            
-            text_widget.insert('end', chunk, tag_name)
+            add_segment(ansi_text[pos:start], current_color)
         
         # Update current color based on the code
         current_color = ANSI_COLOR_MAP.get(color_code, current_color)
@@ -227,14 +236,10 @@ def apply_ansi_colors_to_tk(text_widget, ansi_text):
     
     # Insert any remaining text after the last color code
     if pos < len(ansi_text):
-        chunk = ansi_text[pos:]
-        tag_name = f'fg_{current_color.replace("#", "")}'
-        
-        # Configure tag if not already configured
-        if tag_name not in text_widget.tag_names():
-            text_widget.tag_config(tag_name, foreground=current_color)
-        
-        text_widget.insert('end', chunk, tag_name)
+        add_segment(ansi_text[pos:], current_color)
+    
+    if segments:
+        text_widget.insert('end', *segments)
 
 ###############################################################################
 
@@ -376,8 +381,6 @@ def log(
         if file_path not in _FILE_HANDLER_REGISTRY:
             configure_logging(log_dir=log_dir, log_file=log_file)
 
-    import inspect
-    
     # Get the caller's frame to show the actual script that called log()
     frame = inspect.currentframe()
     caller_filename = 'unknown'
@@ -443,9 +446,16 @@ def file_contains(file: str, pattern: list):
         False
     
     Note:
-        Patterns are joined with '|' (OR) operator for single regex compilation
+        Patterns are joined with '|' (OR) operator for single regex compilation.
+        The compiled regex is cached per pattern list, so repeated calls with
+        the same patterns do not rebuild it.
     """
-    return bool(re.compile('|'.join(pattern)).search(file))
+    return bool(_compile_patterns(tuple(pattern)).search(file))
+
+@lru_cache(maxsize=128)
+def _compile_patterns(patterns: tuple) -> re.Pattern:
+    """Join and compile a tuple of regex patterns into a single alternation."""
+    return re.compile('|'.join(patterns))
 
 def extract_info_from_filename(file_name: str):
     """
@@ -594,6 +604,20 @@ def extract_info_from_filename(file_name: str):
  ###############################################################################
  # Other useful utilities
 ###############################################################################
+def scan_dir(path):
+    """
+    List a directory in a single os.scandir pass.
+    
+    Returns (name, is_dir) pairs for the non-hidden entries, i.e. what
+    glob('*', root_dir=path) plus an isdir() per entry gives, without the
+    extra stat calls. Missing or unreadable directories yield an empty list.
+    """
+    try:
+        with os.scandir(path) as it:
+            return [(entry.name, entry.is_dir()) for entry in it if not entry.name.startswith('.')]
+    except OSError:
+        return []
+
 def delete_files(root, pattern, test=True, recursive=True):
 
     files = sorted(glob(f'**/{pattern}', root_dir=root, recursive=recursive))
@@ -654,6 +678,27 @@ def copy_files(src, dst, pattern, test=True, recursive=True):
             print("##### TEST: No files copied #####")
 
 
+def _run_delete(args):
+    """Command-line handler for the delete subcommand."""
+    delete_files(
+        root=args.root,
+        pattern=args.pattern,
+        test=not args.execute,
+        recursive=not args.no_recursive
+    )
+
+
+def _run_copy(args):
+    """Command-line handler for the copy subcommand."""
+    copy_files(
+        src=args.src,
+        dst=args.dst,
+        pattern=args.pattern,
+        test=not args.execute,
+        recursive=not args.no_recursive
+    )
+
+
 def args_parser():
     """
     Parse command-line arguments for utility functions.
@@ -676,6 +721,7 @@ def args_parser():
     delete_parser.add_argument('pattern', type=str, help='File pattern to match (e.g., "*.log")')
     delete_parser.add_argument('--execute', action='store_true', help='Actually delete files (default is test mode)')
     delete_parser.add_argument('--no-recursive', action='store_true', help='Do not search recursively')
+    delete_parser.set_defaults(func=_run_delete)
     
     # Copy files command
     copy_parser = subparsers.add_parser('copy', help='Copy files matching a pattern')
@@ -684,6 +730,7 @@ def args_parser():
     copy_parser.add_argument('pattern', type=str, help='File pattern to match')
     copy_parser.add_argument('--execute', action='store_true', help='Actually copy files (default is test mode)')
     copy_parser.add_argument('--no-recursive', action='store_true', help='Do not search recursively')
+    copy_parser.set_defaults(func=_run_copy)
     
     args = parser.parse_args()
     return args
@@ -692,21 +739,8 @@ def args_parser():
 if __name__ == "__main__":
     args = args_parser()
     
-    if args.command == 'delete':
-        delete_files(
-            root=args.root,
-            pattern=args.pattern,
-            test=not args.execute,
-            recursive=not args.no_recursive
-        )
-    elif args.command == 'copy':
-        copy_files(
-            src=args.src,
-            dst=args.dst,
-            pattern=args.pattern,
-            test=not args.execute,
-            recursive=not args.no_recursive
-        )
+    if hasattr(args, 'func'):
+        args.func(args)
     else:
         print("Please specify a command: delete or copy")
-        print("Run 'python utils.py --help' for more information")
\ No newline at end of file
+        print("Run 'python utils.py --help' for more information")